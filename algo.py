@@ -1,5 +1,5 @@
+import random
 import time
-import threading
 
 class PortfolioBrain:
     """
@@ -10,7 +10,7 @@ class PortfolioBrain:
     - Plateforme : Render Cloud (Free Tier)
     - Contrainte : 512 Mo RAM max
     - Architecture : Stateless (pas de Redis) -> État stocké en mémoire instance.
-    - Concurrence : Thread-Safe (Optimisé pour Gunicorn avec Workers threadés).
+    - Concurrence : Lock-free (Optimisé pour Gunicorn avec Workers threadés).
     """
 
     # --- Constantes de Configuration (Optimisées Free Tier) ---
@@ -26,68 +26,155 @@ class PortfolioBrain:
     TIMEOUT_MAX = 10.0
     
     DEFAULT_TIMEOUT = 3.0
+    INITIAL_RTTVAR = 0.5
     
     # Gestion du "Cold Start" (Démarrage à froid) :
     # Les instances Free Tier s'endorment après inactivité.
     # Après 10 min (600s), on considère que le contexte réseau a changé.
-    MEMORY_TTL = 600  
+    MEMORY_TTL = 600
 
-    def __init__(self):
-        # 🔒 LOCK (THREAD SAFETY) : CRITIQUE SUR 512 Mo RAM
-        # Pour économiser la RAM, on utilise des Threads plutôt que des Processus multiples.
-        # Ce verrou empêche deux requêtes simultanées de corrompre les calculs de latence.
-        self._lock = threading.Lock()
+    # --- Estimateur de queue (P99 sur histogramme glissant) ---
+    # 4 * RTTVAR suppose un bruit "gaussien" et sous-estime le P99 quand la latence est
+    # bimodale (Cold Start OpenWeather + régime chaud). On garde donc un histogramme
+    # log2 des dernières latences et on ne descend jamais sous SAFETY_FACTOR * P99.
+    HISTOGRAM_BUCKETS = 32     # bucket b = latences dans [2^(b-1), 2^b[ ms
+    WINDOW_SIZE = 128          # nb d'échantillons récents pris en compte
+    MIN_SAMPLES = 10           # en dessous : pas assez de données -> Jacobson seul
+    P99_SAFETY_FACTOR = 1.5
+    TAIL_REFRESH = 32          # plancher P99 recalculé tous les k échantillons (1/4 de fenêtre)
+
+    # --- Backoff exponentiel (Karn + RFC 6298 §5.5) ---
+    # timeout = RTO de base * 2^attempt + jitter, plafonné à TIMEOUT_MAX.
+    # Les échecs ne touchent ni SRTT ni RTTVAR : le RTO de base reste figé pendant toute
+    # la série d'échecs, d'où un doublement propre 1s -> 2s -> 4s -> 8s -> 10s.
+    # Le jitter décorrèle les threads Gunicorn qui voient l'API revenir en même temps
+    # (évite le "thundering herd" de retries synchronisés).
+    MAX_BACKOFF_ATTEMPTS = 6
+    BACKOFF_JITTER = 0.5
 
+    # Pas de __dict__ par instance : accès attribut direct par descripteur (plus rapide)
+    # et empreinte mémoire minimale. État Jacobson dans _state, fenêtre P99 dans les autres slots.
+    __slots__ = ("_state", "_ring", "_counts", "_head", "_filled", "_tail")
+
+    def __init__(self):
         # --- État initial (Algorithme de Jacobson) ---
         
         # SRTT (Smoothed Round Trip Time) : La "Moyenne"
         # Initialisé à 3s pour être tolérant au démarrage (Cold Start de l'API externe)
-        self.srtt = self.DEFAULT_TIMEOUT
+        srtt = self.DEFAULT_TIMEOUT
         
         # RTTVAR (Round Trip Time Variation) : L' "Incertitude"
         # Initialisé à 0.5s. Plus c'est haut, plus on prend de marge.
-        self.rttvar = 0.5
-        
-        # Le timeout actuel calculé (Ready to use)
-        self.current_timeout = self._calc_timeout_unsafe()
-        
-        self.last_request_time = time.time()
+        rttvar = self.INITIAL_RTTVAR
+
+        # ⚛️ ÉTAT ATOMIQUE (THREAD SAFETY SANS VERROU)
+        # Tout l'état tient dans UN tuple immuable :
+        # (srtt, rttvar, current_timeout, last_request_time, attempt).
+        # Chaque méthode lit un snapshot, calcule un nouveau tuple, puis le remplace en une seule
+        # affectation d'attribut (atomique sous le GIL CPython). Un lecteur voit donc toujours
+        # un état cohérent, sans mutex ni futex à chaque requête.
+        # Course bénigne : deux updates simultanés -> le dernier gagne (un échantillon perdu,
+        # ce que le lissage Jacobson tolère très bien).
+        # attempt : nb d'échecs consécutifs (remis à 0 au premier succès)
+        self._state = (srtt, rttvar, self._calc_timeout(srtt, rttvar, 0.0), time.monotonic(), 0)
+
+        # Fenêtre glissante P99 : ring préalloué (index de bucket par échantillon) + tête d'écriture,
+        # histogramme tenu à jour incrémentalement (+1 entrant, -1 sortant), aucun objet alloué
+        # par échantillon. Mutable et sans verrou : une course peut perdre ou doubler un comptage,
+        # l'histogramme est donc reconstruit depuis le ring à chaque tour complet (dérive bornée).
+        self._ring = [0] * self.WINDOW_SIZE
+        self._counts = [0] * self.HISTOGRAM_BUCKETS
+        self._head = 0
+        self._filled = 0
+        self._tail = 0.0  # Plancher P99 courant (0 tant que < MIN_SAMPLES)
+
+    # --- Accès en lecture (compatibilité : tests, simulation, /stats) ---
+
+    @property
+    def srtt(self):
+        return self._state[0]
+
+    @property
+    def rttvar(self):
+        return self._state[1]
+
+    @property
+    def current_timeout(self):
+        return self._state[2]
+
+    @property
+    def last_request_time(self):
+        # Horloge monotone (time.monotonic) : insensible aux sauts NTP, ne sert qu'aux intervalles
+        return self._state[3]
 
-    def _calc_timeout_unsafe(self):
+    @last_request_time.setter
+    def last_request_time(self, value):
+        # Utilisé par la simulation pour "vieillir" artificiellement l'instance
+        srtt, rttvar, timeout, _, attempt = self._state
+        self._state = (srtt, rttvar, timeout, value, attempt)
+
+    @property
+    def attempt(self):
+        return self._state[4]
+
+    def _calc_timeout(self, srtt, rttvar, tail):
         """
         Calcul pur du RTO (Retransmission Timeout).
-        [Interne] Doit toujours être appelé sous Lock.
+        [Interne] Sans effet de bord : travaille sur un snapshot de l'état.
         """
         # Formule TCP standard (RFC 6298) : Moyenne + 4 * Variation
         # Pourquoi 4 ? Pour couvrir 99.9% des cas statistiques et éviter les faux positifs.
-        rto = self.srtt + (4 * self.rttvar)
+        # Le plancher P99 (tail) rattrape les cas où la distribution réelle a une queue plus lourde.
+        rto = max(srtt + (4 * rttvar), tail)
         
         # Bornage de sécurité (Clamp)
         return max(self.TIMEOUT_MIN, min(self.TIMEOUT_MAX, rto))
 
+    def _backoff_rto(self, srtt, rttvar, tail, attempt):
+        """
+        RTO après `attempt` échecs consécutifs (sans jitter ni plafond).
+        [Interne] Formule unique du Backoff, partagée par _step et apply_backoff.
+        """
+        return max(self.TIMEOUT_MIN, srtt + 4 * rttvar, tail) * (1 << attempt)
+
     def get_timeout(self):
         """
         Appelé AVANT une requête pour savoir combien de temps attendre.
         Gère intelligemment les réveils de l'instance (Soft Decay).
         """
-        with self._lock:
-            # 1. Vérification de l'inactivité (Instance endormie ?)
-            time_since_last = time.time() - self.last_request_time
+        # Snapshot unique de l'état (lecture atomique)
+        srtt, rttvar, timeout, last_ts, attempt = self._state
+
+        # 1. Vérification de l'inactivité (Instance endormie ?)
+        now = time.monotonic()
+        time_since_last = now - last_ts
+        
+        if time_since_last > self.MEMORY_TTL:
+            # --- STRATÉGIE "SOFT DECAY" ---
+            # L'instance se réveille ou n'a pas servi depuis longtemps.
+            # On ne reset pas tout (pour garder l'historique), mais on double l'incertitude.
+            # Cela élargit le timeout par prudence pour la première requête.
+            rttvar = max(rttvar * 2, 1.0)
+            
+            # Recalcul immédiat avec cette nouvelle prudence
+            timeout = self._calc_timeout(srtt, rttvar, self._tail)
             
-            if time_since_last > self.MEMORY_TTL:
-                # --- STRATÉGIE "SOFT DECAY" ---
-                # L'instance se réveille ou n'a pas servi depuis longtemps.
-                # On ne reset pas tout (pour garder l'historique), mais on double l'incertitude.
-                # Cela élargit le timeout par prudence pour la première requête.
-                self.rttvar = max(self.rttvar * 2, 1.0)
-                
-                # Recalcul immédiat avec cette nouvelle prudence
-                self.current_timeout = self._calc_timeout_unsafe()
-                
-                # On "touche" le timestamp pour ne pas répéter l'opération
-                self.last_request_time = time.time()
-
-            return self.current_timeout
+            # On "touche" le timestamp pour ne pas répéter l'opération
+            self._state = (srtt, rttvar, timeout, now, attempt)
+
+        return timeout
+
+    def apply_backoff(self, n_timeouts: int) -> float:
+        """
+        Projection directe du Backoff exponentiel (RFC 6298 §5.5 : RTO <- RTO * 2 par timeout).
+        Renvoie le timeout après n échecs consécutifs, plafonné, en O(1) et sans jitter
+        ni modification de l'état (tests, planification de retries) : même formule que
+        update(..., success=False), lue sur un snapshot (pas de Soft Decay déclenché).
+        """
+        # n borné comme le compteur d'échecs de _step (négatif -> 0)
+        n = min(max(n_timeouts, 0), self.MAX_BACKOFF_ATTEMPTS)
+        srtt, rttvar, _, _, _ = self._state
+        return min(self.TIMEOUT_MAX, self._backoff_rto(srtt, rttvar, self._tail, n))
 
     def update(self, observed_latency, success: bool):
         """
@@ -97,47 +184,157 @@ class PortfolioBrain:
         :param observed_latency: Temps mis par la requête (en secondes)
         :param success: True si le réseau a répondu, False si Timeout/Erreur.
         """
-        with self._lock:
-            self.last_request_time = time.time()
-
-            if not success:
-                # --- PUNITION (Algorithme de Karn) ---
-                # Le réseau est instable ou l'API est down.
-                # On ignore cette mesure (car faussée) et on double le timeout (Backoff).
-                # Cela évite de marteler une API qui souffre déjà (Bonne pratique Cloud).
-                self.current_timeout = min(self.TIMEOUT_MAX, self.current_timeout * 2)
-                
-                # On augmente l'incertitude pour les prochains coups
-                self.rttvar += 0.5
-            
+        # Snapshot -> calcul -> publication atomique du nouvel état
+        self._state = self._step(self._state, observed_latency, success, time.monotonic())
+
+    def update_batch(self, latencies, success: bool = True):
+        """
+        Rejoue une série de mesures en une seule fois (simulation, tests).
+        Un seul snapshot et une seule publication de _state pour tout le lot ; la fenêtre
+        P99, elle, reste alimentée échantillon par échantillon.
+
+        :param latencies: Itérable de latences en secondes (liste, tuple, array NumPy...)
+        :param success: Issue commune à toutes les mesures du lot.
+        """
+        # Pas de formule fermée ici : l'asymétrie du Beta, le reset après panne et le
+        # plancher P99 rendent la récurrence non linéaire -> on la déroule, mais sans
+        # repasser par update() (ni relire l'état / l'horloge) à chaque échantillon.
+        step = self._step
+        state = self._state
+        now = time.monotonic()
+        for latency in latencies:
+            state = step(state, latency, success, now)
+        self._state = state
+
+    def _step(self, state, observed_latency, success, now):
+        """
+        Une itération de l'algorithme : snapshot d'état -> nouvel état.
+        [Interne] Seule la fenêtre P99 est alimentée ici ; l'appelant publie l'état.
+        """
+        srtt, rttvar, timeout, _, attempt = state
+        tail = self._tail
+
+        if success:
+            # --- RÉCOMPENSE (Algorithme de Jacobson) ---
+            # Tout va bien, on affine le modèle mathématique.
+
+            # 0. Sortie de panne : le premier succès après des échecs remet l'incertitude à sa
+            #    valeur initiale (reset complet de l'état de backoff, comme libutp / TCP Linux).
+            #    Choix délibéré : après une panne d'OpenWeather, la variance mesurée avant ne dit
+            #    plus rien du réseau qui revient, on repart donc de la prudence du démarrage. Sur
+            #    un lien stable (RTTVAR < 0.5) cela ÉLARGIT le timeout le temps de quelques mesures.
+            if attempt:
+                rttvar = self.INITIAL_RTTVAR
+
+            # 1. L'Erreur (Différence entre notre prédiction et la réalité)
+            # RFC 6298 : RTTVAR est calculé avec le SRTT *avant* mise à jour.
+            diff = observed_latency - srtt
+
+            # 2. Mise à jour de la Moyenne (Alpha = 0.125)
+            # On lisse doucement (12.5% de poids à la nouvelle mesure)
+            new_srtt = srtt + (0.125 * diff)
+
+            # 3. Mise à jour de la Variance (Beta = 0.25)
+            # Si la latence est stable, rttvar diminue -> timeout plus court et réactif.
+            # Si la latence fait le yoyo, rttvar augmente -> timeout plus large et sûr.
+            # Asymétrie Linux (tcp_input.c) : si la latence CHUTE sous la bande attendue
+            # (m < srtt - rttvar), l'échantillon pèse 8x moins (Beta = 1/32). Sinon une
+            # amélioration du réseau ferait paradoxalement gonfler le timeout.
+            beta = 0.03125 if observed_latency < srtt - rttvar else 0.25
+            new_rttvar = rttvar + (beta * (abs(diff) - rttvar))
+
+            # 4. Fenêtre P99 : seules les vraies mesures (succès) l'alimentent (règle de Karn).
+            #    Déroulée ici plutôt que dans une méthode : c'est le chemin chaud de chaque requête.
+            # Index log2 en ms sans math.log2 : bit_length(int(ms)) = floor(log2(ms)) + 1 (0 si < 1 ms)
+            idx = int(observed_latency * 1000).bit_length()
+            if idx >= self.HISTOGRAM_BUCKETS:
+                idx = self.HISTOGRAM_BUCKETS - 1
+            ring = self._ring
+            counts = self._counts
+            head = self._head
+            filled = self._filled
+            if filled == self.WINDOW_SIZE:
+                # Fenêtre pleine : l'échantillon le plus ancien (sous la tête) sort de l'histogramme
+                counts[ring[head]] -= 1
             else:
-                # --- RÉCOMPENSE (Algorithme de Jacobson) ---
-                # Tout va bien, on affine le modèle mathématique.
-                
-                # 1. L'Erreur (Différence entre notre prédiction et la réalité)
-                diff = observed_latency - self.srtt
-                
-                # 2. Mise à jour de la Moyenne (Alpha = 0.125)
-                # On lisse doucement (12.5% de poids à la nouvelle mesure)
-                self.srtt = self.srtt + (0.125 * diff)
-                
-                # 3. Mise à jour de la Variance (Beta = 0.25)
-                # Si la latence est stable, rttvar diminue -> timeout plus court et réactif.
-                # Si la latence fait le yoyo, rttvar augmente -> timeout plus large et sûr.
-                self.rttvar = self.rttvar + (0.25 * (abs(diff) - self.rttvar))
-                
-                # 4. Mise à jour finale
-                self.current_timeout = self._calc_timeout_unsafe()
+                filled += 1
+                self._filled = filled
+            ring[head] = idx
+            counts[idx] += 1
+            head += 1
+            if head == self.WINDOW_SIZE:
+                head = 0
+                # Tour complet : on recompte depuis le ring pour effacer une éventuelle dérive
+                counts = self._counts = self._rebuild_counts(ring)
+            self._head = head
+            # Sur 128 échantillons, le P99 ne dépend que des 2 plus lents : recalcul tous les k seulement
+            if filled >= self.MIN_SAMPLES and (not head % self.TAIL_REFRESH or filled == self.MIN_SAMPLES):
+                tail = self._tail = self._p99_floor(counts, filled)
+
+            # 5. RTO Jacobson (Moyenne + 4 * Variation), jamais sous le plancher P99
+            attempt = 0
+            rto = new_srtt + 4 * new_rttvar
+            if rto < tail:
+                rto = tail
+
+        else:
+            # --- PUNITION (Algorithme de Karn) ---
+            # Le réseau est instable ou l'API est down.
+            # On ignore cette mesure (car faussée) : SRTT et RTTVAR inchangés, c'est le
+            # compteur d'échecs qui porte la punition.
+            new_srtt = srtt
+            new_rttvar = rttvar
+
+            # Backoff exponentiel depuis le RTO de base + jitter,
+            # pour ne pas marteler une API qui souffre.
+            attempt = min(attempt + 1, self.MAX_BACKOFF_ATTEMPTS)
+            rto = self._backoff_rto(srtt, rttvar, tail, attempt) + random.uniform(0, self.BACKOFF_JITTER)
+
+        # Bornage de sécurité (Clamp), en comparaisons plutôt qu'en appels min/max
+        if rto > self.TIMEOUT_MAX:
+            rto = self.TIMEOUT_MAX
+        elif rto < self.TIMEOUT_MIN:
+            rto = self.TIMEOUT_MIN
+
+        return (new_srtt, new_rttvar, rto, now, attempt)
+
+    def _rebuild_counts(self, ring):
+        """
+        Histogramme recompté depuis le ring.
+        [Interne] Les comptages incrémentaux sans verrou peuvent dériver sous course : on repart
+        du ring (source de vérité) une fois par tour de fenêtre.
+        """
+        counts = [0] * self.HISTOGRAM_BUCKETS
+        for b in ring:
+            counts[b] += 1
+        return counts
+
+    def _p99_floor(self, counts, total):
+        """
+        Plancher P99 (en secondes) d'un histogramme de `total` échantillons.
+        [Interne] Remonte depuis le bucket le plus lent jusqu'à couvrir 1% des échantillons.
+        """
+        remaining = -(-total // 100)  # ceil(1%)
+        b = len(counts)
+        for count in reversed(counts):
+            b -= 1
+            remaining -= count
+            if remaining <= 0:
+                # Borne haute du bucket (en secondes) x facteur de sécurité
+                return self.P99_SAFETY_FACTOR * (1 << b) / 1000.0
+        return 0.0
 
     def get_stats(self):
         """
         Observabilité légère (Pas d'agent Datadog/NewRelic pour économiser la RAM).
         Permet de vérifier la santé du système via des logs simples.
         """
-        with self._lock:
-            return {
-                "srtt": round(self.srtt, 3),            # Latence moyenne estimée
-                "rttvar": round(self.rttvar, 3),        # Instabilité du réseau
-                "timeout": round(self.current_timeout, 3), # Timeout appliqué
-                "idle_sec": round(time.time() - self.last_request_time, 1) # Temps depuis dernier appel
-            }
\ No newline at end of file
+        srtt, rttvar, timeout, last_ts, attempt = self._state
+        return {
+            "srtt": round(srtt, 3),            # Latence moyenne estimée
+            "rttvar": round(rttvar, 3),        # Instabilité du réseau
+            "timeout": round(timeout, 3), # Timeout appliqué
+            "p99_floor": round(self._tail, 3), # Plancher issu du P99 observé
+            "attempt": attempt,                # Échecs consécutifs (backoff en cours)
+            "idle_sec": round(time.monotonic() - last_ts, 1) # Temps depuis dernier appel
+        }
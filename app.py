@@ -20,16 +20,21 @@ Render Free Tier:
 
 from __future__ import annotations
 
+import itertools
 import logging
 import os
+import threading
 import time
-import uuid
 from dataclasses import dataclass
-from typing import Any, Dict, Optional, Tuple
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple, Union
 
+import orjson
 import requests
+from cachetools import TTLCache
 from dotenv import load_dotenv
-from flask import Flask, jsonify, render_template, request, g, send_file
+from flask import Flask, Response, render_template, request, g, send_file
+from flask.json.provider import DefaultJSONProvider
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 # ✅ IMPORT DU CERVEAU (Lien avec ton fichier algo)
@@ -54,9 +59,16 @@ class Settings:
     retry_total: int = int(os.getenv("RETRY_TOTAL", "2"))
     retry_backoff_factor: float = float(os.getenv("RETRY_BACKOFF_FACTOR", "0.4"))
 
+    # Pool HTTP : >= nb de threads Gunicorn (sinon les threads en trop attendent une connexion
+    # libre et ce temps d'attente fausse les latences vues par le cerveau)
+    http_pool_size: int = int(os.getenv("HTTP_POOL_SIZE", "32"))
+
     # Cache & Rate Limit
     cache_ttl_s: int = int(os.getenv("CACHE_TTL_S", "120"))
     cache_max_items: int = int(os.getenv("CACHE_MAX_ITEMS", "600"))
+    # Autocomplete : le géocodage est stable sur des jours, 5 min de TTL reste prudent
+    autocomplete_cache_ttl_s: int = int(os.getenv("AUTOCOMPLETE_CACHE_TTL_S", "300"))
+    autocomplete_cache_max_items: int = int(os.getenv("AUTOCOMPLETE_CACHE_MAX_ITEMS", "500"))
     rate_limit_enabled: bool = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes", "on")
     rate_limit_default: str = os.getenv("RATE_LIMIT_DEFAULT", "120 per minute")
     rate_limit_get_weather: str = os.getenv("RATE_LIMIT_GET_WEATHER", "30 per minute")
@@ -66,7 +78,34 @@ class Settings:
 API_KEY = os.getenv("API_KEY", "")
 settings = Settings(api_key=API_KEY)
 
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON Flask (jsonify, request.get_json, client de test) via orjson : encode/decode en C."""
+
+    # Ordre d'insertion conservé par défaut (payloads déjà construits dans l'ordre voulu) ;
+    # sort_keys=True explicite reste honoré.
+    sort_keys = False
+
+    def dumpb(self, obj: Any, **kwargs: Any) -> bytes:
+        # Sortie bytes, partagée avec _json() et les erreurs pré-calculées : un seul chemin orjson.
+        # Clés non-str (int, ...) acceptées comme avec json.dumps ; orjson n'indente que sur 2.
+        # Dates et dataclasses : orjson les sérialise nativement (ISO 8601) sans jamais appeler
+        # default ; PASSTHROUGH les renvoie à default=... pour garder la sortie Flask (HTTP date).
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if kwargs.get("sort_keys", self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return self.dumpb(obj, **kwargs).decode()
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.config["JSONIFY_PRETTYPRINT_REGULAR"] = False
 
 # ✅ INITIALISATION DU CERVEAU (Mémoire globale)
@@ -85,6 +124,17 @@ logger = logging.getLogger("geometeo")
 if not settings.api_key:
     logger.warning('{"level":"WARN","msg":"API_KEY manquante - /get_weather renverra 500 tant que non configurée"}')
 
+# Health check Render (toutes les ~30s) : réponse immédiate, sans request_id, timing ni
+# rate limit. Enregistré AVANT Flask-Limiter : les before_request s'exécutent dans l'ordre
+# d'enregistrement, la sonde ne touche donc jamais le stockage du limiter (pas de 429).
+# request.endpoint vient du routage Werkzeug : seuls GET/HEAD /health matchent, un POST
+# garde son 405.
+@app.before_request
+def _health_short_circuit():
+    if request.endpoint == "health":
+        return health()
+
+
 # -----------------------------------------------------------------------------
 # Optional: Rate limiting (memory) – FREE TIER friendly
 # -----------------------------------------------------------------------------
@@ -119,41 +169,49 @@ retry = Retry(
     allowed_methods=("GET",),
     raise_on_status=False,
 )
-adapter = HTTPAdapter(max_retries=retry, pool_connections=10, pool_maxsize=10)
+# pool_block=False : pool vide -> nouvelle connexion immédiate plutôt qu'attente sur le verrou du pool
+adapter = HTTPAdapter(
+    max_retries=retry,
+    pool_connections=10,
+    pool_maxsize=settings.http_pool_size,
+    pool_block=False,
+)
 session.mount("https://", adapter)
 
 # -----------------------------------------------------------------------------
 # Cache mémoire TTL (simple, suffisant sur free tier)
 # -----------------------------------------------------------------------------
-# key -> (expires_at_epoch, payload)
-_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+# key -> payload ; expiration + éviction gérées par cachetools (hit O(1), pas de
+# balayage O(N) des clés quand le cache est plein).
+# cachetools n'est PAS thread-safe -> un seul RLock autour des accès (threads Gunicorn).
+_cache: TTLCache = TTLCache(maxsize=settings.cache_max_items, ttl=settings.cache_ttl_s)
+_cache_lock = threading.RLock()
+
+# Cache dédié à /autocomplete (clé = préfixe tapé en minuscules) : la frappe "Paris"
+# redemande sans cesse les mêmes préfixes. Même verrou que le cache météo.
+_autocomplete_cache: TTLCache = TTLCache(
+    maxsize=settings.autocomplete_cache_max_items,
+    ttl=settings.autocomplete_cache_ttl_s,
+)
 
 
-def _cache_get(key: str) -> Optional[Dict[str, Any]]:
-    item = _cache.get(key)
-    if not item:
-        return None
-    expires_at, payload = item
-    if time.time() > expires_at:
-        _cache.pop(key, None)
-        return None
-    return payload
+def _cache_get(key: Union[int, str]) -> Optional[Dict[str, Any]]:
+    with _cache_lock:
+        return _cache.get(key)
 
 
-def _cache_set(key: str, payload: Dict[str, Any]) -> None:
-    # Eviction simple pour éviter de grossir indéfiniment en free tier
-    if len(_cache) >= settings.cache_max_items:
-        # supprime ~10% des entrées (simple et efficace)
-        for i, k in enumerate(list(_cache.keys())):
-            _cache.pop(k, None)
-            if i >= max(1, settings.cache_max_items // 10):
-                break
-    _cache[key] = (time.time() + settings.cache_ttl_s, payload)
+def _cache_set(key: Union[int, str], payload: Dict[str, Any]) -> None:
+    with _cache_lock:
+        _cache[key] = payload
 
 
 # -----------------------------------------------------------------------------
 # Validation input (senior: éviter tout ce qui est "bizarre")
 # -----------------------------------------------------------------------------
+# Fonctions pures -> mémoïsées : une ville re-demandée ne repasse pas par la validation.
+# Mémoire bornée : 1024 entrées, chaque entrée limitée par la taille max de la ligne
+# de requête Gunicorn (~4 Ko) -> quelques Mo au pire.
+@lru_cache(maxsize=1024)
 def _parse_city(raw: Optional[str]) -> Optional[str]:
     if raw is None:
         return None
@@ -165,6 +223,7 @@ def _parse_city(raw: Optional[str]) -> Optional[str]:
     return city
 
 
+@lru_cache(maxsize=1024)
 def _parse_lat_lon(raw_lat: Optional[str], raw_lon: Optional[str]) -> Optional[Tuple[float, float]]:
     if raw_lat is None or raw_lon is None:
         return None
@@ -178,15 +237,46 @@ def _parse_lat_lon(raw_lat: Optional[str], raw_lon: Optional[str]) -> Optional[T
     return lat, lon
 
 
-def _cache_key(city: Optional[str], latlon: Optional[Tuple[float, float]]) -> str:
+def _cache_key(city: Optional[str], latlon: Optional[Tuple[float, float]]) -> Union[int, str]:
     # On priorise le cache par GPS
     if latlon is not None:
-        return f"coord:{latlon[0]:.4f},{latlon[1]:.4f}"
+        # Clé entière 64 bits (précision 1e-4°, ~11 m) : lat et lon décalées en positif puis
+        # empaquetées. Hash d'un int = identité -> pas de f-string ni de hash de chaîne par requête.
+        # lon: [0, 3.6e6] < 2^22 tient sous le décalage de 24 bits -> aucune collision possible.
+        return (round((latlon[0] + 90.0) * 1e4) << 24) | round((latlon[1] + 180.0) * 1e4)
     if city:
-        return f"city:{city.lower()}"
+        # Les clés ville restent des str (jamais en collision avec les clés GPS entières)
+        return city.lower()
     return "unknown"
 
 
+# -----------------------------------------------------------------------------
+# Réponses JSON (orjson : sérialisation C, sortie compacte -> moins de CPU et d'egress)
+# -----------------------------------------------------------------------------
+def _json(data: Any, status: int = 200) -> Response:
+    return _json_bytes(app.json.dumpb(data), status)
+
+
+def _json_bytes(body: bytes, status: int = 200) -> Response:
+    # Corps déjà sérialisé (réponses d'erreur pré-calculées ci-dessous)
+    return Response(body, status=status, mimetype="application/json")
+
+
+# Réponses d'erreur statiques sérialisées une seule fois au chargement :
+# pendant un incident OpenWeather, ce sont elles le chemin chaud.
+_EMPTY_LIST = app.json.dumpb([])
+_ERR_BAD_PARAMS = app.json.dumpb({"error": "Veuillez fournir une ville valide ou des coordonnées valides."})
+_ERR_NO_API_KEY = app.json.dumpb({"error": "Service mal configuré (API key manquante)."})
+_ERR_NOT_FOUND = app.json.dumpb({"error": "Ville introuvable."})
+_ERR_UNAUTHORIZED = app.json.dumpb({"error": "Erreur de configuration côté serveur."})
+_ERR_RATE_LIMITED = app.json.dumpb({"error": "Service météo temporairement surchargé. Réessayez."})
+_ERR_PROVIDER = app.json.dumpb({"error": "Service météo indisponible (erreur fournisseur)."})
+_ERR_UNEXPECTED = app.json.dumpb({"error": "Réponse inattendue du service météo."})
+_ERR_TIMEOUT = app.json.dumpb({"error": "Le service météo met trop de temps à répondre."})
+_ERR_CONNECTION = app.json.dumpb({"error": "Erreur de connexion au service météo."})
+_ERR_INVALID = app.json.dumpb({"error": "Réponse invalide du service météo."})
+
+
 # -----------------------------------------------------------------------------
 # Mapping OpenWeather -> payload client
 # -----------------------------------------------------------------------------
@@ -225,58 +315,88 @@ def _map_openweather(data: Dict[str, Any]) -> Dict[str, Any]:
 # -----------------------------------------------------------------------------
 # Request lifecycle: request_id + timing
 # -----------------------------------------------------------------------------
+# Headers sécurité construits une seule fois (jamais posés ailleurs -> update direct)
+_SECURITY_HEADERS = {
+    "X-Content-Type-Options": "nosniff",
+    "Referrer-Policy": "strict-origin-when-cross-origin",
+    "X-Frame-Options": "DENY",
+    # Permissions-Policy minimaliste
+    "Permissions-Policy": "geolocation=(), microphone=(), camera=()",
+}
+
+# request_id = préfixe worker (pid, 4 hex) + compteur (8 hex) -> 12 caractères comme avant,
+# sans syscall /dev/urandom ni objet UUID par requête. next() sur itertools.count est
+# atomique sous le GIL : pas de verrou entre threads Gunicorn.
+_WORKER_PREFIX = f"{os.getpid() & 0xFFFF:04x}"
+_req_counter = itertools.count()
+
+
 @app.before_request
 def _before_request() -> None:
-    g.request_id = request.headers.get("X-Request-Id") or uuid.uuid4().hex[:12]
-    g.start_time = time.time()
+    g.request_id = request.headers.get("X-Request-Id") or f"{_WORKER_PREFIX}{next(_req_counter):08x}"
+    g.start_time = time.monotonic()
 
 
 @app.after_request
 def _after_request(response):
+    # /health court-circuité en amont : pas de headers ni de log (logs Render lisibles)
+    if request.endpoint == "health":
+        return response
+
     # Basic security headers (lightweight, free-tier friendly)
     if settings.add_security_headers:
-        response.headers.setdefault("X-Content-Type-Options", "nosniff")
-        response.headers.setdefault("Referrer-Policy", "strict-origin-when-cross-origin")
-        response.headers.setdefault("X-Frame-Options", "DENY")
-        # Permissions-Policy minimaliste
-        response.headers.setdefault("Permissions-Policy", "geolocation=(), microphone=(), camera=()")
+        response.headers.update(_SECURITY_HEADERS)
 
     # Corrélation côté client si tu veux debugger
     response.headers["X-Request-Id"] = getattr(g, "request_id", "unknown")
 
     # Log “1 ligne” par requête (Render-friendly)
-    try:
-        dur_ms = int((time.time() - g.start_time) * 1000)
-    except Exception:
-        dur_ms = -1
-
-    logger.info(
-        '{"level":"INFO","request_id":"%s","method":"%s","path":"%s","status":%s,"duration_ms":%s}',
-        getattr(g, "request_id", "unknown"),
-        request.method,
-        request.path,
-        response.status_code,
-        dur_ms,
-    )
+    # Rien à calculer si le niveau le masque (LOG_LEVEL=WARNING en prod calme)
+    if logger.isEnabledFor(logging.INFO):
+        try:
+            dur_ms = int((time.monotonic() - g.start_time) * 1000)
+        except Exception:
+            dur_ms = -1
+
+        logger.info(
+            '{"level":"INFO","request_id":"%s","method":"%s","path":"%s","status":%s,"duration_ms":%s}',
+            getattr(g, "request_id", "unknown"),
+            request.method,
+            request.path,
+            response.status_code,
+            dur_ms,
+        )
     return response
 
 
 # -----------------------------------------------------------------------------
 # Routes
 # -----------------------------------------------------------------------------
-@app.route("/")
+# GET uniquement. Flask ajoute HEAD/OPTIONS automatiquement : OPTIONS est servi sans
+# entrer dans la vue, HEAD (sondes de monitoring) est court-circuité là où la vue coûte cher.
+@app.route("/", methods=["GET"])
 def home():
     # ✅ IMPORTANT : Pointe vers index.html (renomme ton fichier geometeo4.html)
     return render_template("index.html")
 
-@app.route("/health")
+@app.route("/health", methods=["GET"])
 def health():
+    # Servi par _health_short_circuit, avant tout autre hook (la route porte le routage GET/HEAD)
     return "ok", 200
 
-@app.route("/autocomplete")
+@app.route("/autocomplete", methods=["GET"])
 def autocomplete():
+    if request.method == "HEAD":
+        return "", 200
+
     query = request.args.get("q", "").strip()
-    if not query or len(query) < 2: return jsonify([])
+    if not query or len(query) < 2: return _json_bytes(_EMPTY_LIST)
+
+    key = query.lower()
+    with _cache_lock:
+        cached = _autocomplete_cache.get(key)
+    if cached is not None:
+        return _json(cached)
 
     # 1. On demande le timeout intelligent au cerveau (Jacobson)
     dynamic_timeout = brain.get_timeout() 
@@ -285,13 +405,13 @@ def autocomplete():
     timeouts = (settings.connect_timeout_s, dynamic_timeout)
     
     params = {"q": query, "limit": 5, "appid": settings.api_key}
-    start = time.time()
+    start = time.monotonic()
     
     try:
         # 2. Utilisation de 'session.get' pour bénéficier des Retries
         resp = session.get(settings.geocoding_url, params=params, timeout=timeouts)
         
-        latency = time.time() - start
+        latency = time.monotonic() - start
         
         # 3. On informe le cerveau du succès (même si c'est une 404, le réseau a répondu)
         brain.update(latency, success=True)
@@ -306,18 +426,21 @@ def autocomplete():
             state = item.get('state', '')
             label = f"{name}, {state}, {country}" if state else f"{name}, {country}"
             suggestions.append({"label": label, "lat": item.get('lat'), "lon": item.get('lon')})
-            
-        return jsonify(suggestions)
+
+        # Seules les réponses valides sont mises en cache (jamais le [] d'erreur)
+        with _cache_lock:
+            _autocomplete_cache[key] = suggestions
+        return _json(suggestions)
 
     except Exception as e:
         # 4. En cas de timeout réel, on applique la punition de Karn (Backoff)
-        latency = time.time() - start
+        latency = time.monotonic() - start
         brain.update(latency, success=False)
         
         logger.warning(f"Autocomplete error: {e}")
-        return jsonify([])
+        return _json_bytes(_EMPTY_LIST)
 
-@app.route("/get_weather")
+@app.route("/get_weather", methods=["GET"])
 def get_weather():
     # Rate limit spécifique sur cette route (si Flask-Limiter dispo)
     # (On l'applique via décorateur dynamique si possible)
@@ -332,17 +455,22 @@ def _get_weather_impl():
     latlon = _parse_lat_lon(request.args.get("lat"), request.args.get("lon"))
 
     if not city and not latlon:
-        return jsonify({"error": "Veuillez fournir une ville valide ou des coordonnées valides."}), 400
+        return _json_bytes(_ERR_BAD_PARAMS, 400)
 
     if not settings.api_key:
-        return jsonify({"error": "Service mal configuré (API key manquante)."}), 500
+        return _json_bytes(_ERR_NO_API_KEY, 500)
+
+    if request.method == "HEAD":
+        # Sonde HEAD : même statut que GET pour les contrôles locaux (rate limit, 400, 500),
+        # mais ni cache ni appel OpenWeather
+        return "", 200
 
     key = _cache_key(city, latlon)
     cached = _cache_get(key)
     if cached:
         payload = dict(cached)
         payload["_cached"] = True
-        return jsonify(payload), 200
+        return _json(payload, 200)
 
     params: Dict[str, Any] = {
         "appid": settings.api_key,
@@ -362,7 +490,7 @@ def _get_weather_impl():
     timeouts = (settings.connect_timeout_s, dynamic_timeout)
 
     # 2) Appel OpenWeather
-    start = time.time()
+    start = time.monotonic()
     try:
         # ✅ CORRECTION : On utilise 'timeouts' (le dynamique) ici
         resp = session.get(
@@ -372,7 +500,7 @@ def _get_weather_impl():
         )
         
         # ✅ CALCUL LATENCE (pour le cerveau et les logs)
-        latency = time.time() - start
+        latency = time.monotonic() - start
         dur_ms = int(latency * 1000)
 
         # 3) Mapping codes OpenWeather
@@ -380,7 +508,7 @@ def _get_weather_impl():
         
         if resp.status_code == 404:
             brain.update(latency, success=True) # ✅
-            return jsonify({"error": "Ville introuvable."}), 404
+            return _json_bytes(_ERR_NOT_FOUND, 404)
 
         if resp.status_code == 401:
             brain.update(latency, success=True) # ✅
@@ -388,15 +516,15 @@ def _get_weather_impl():
                 '{"level":"ERROR","request_id":"%s","msg":"OpenWeather unauthorized","duration_ms":%s}',
                 getattr(g, "request_id", "unknown"), dur_ms,
             )
-            return jsonify({"error": "Erreur de configuration côté serveur."}), 502
+            return _json_bytes(_ERR_UNAUTHORIZED, 502)
 
         if resp.status_code == 429:
             brain.update(latency, success=True) # ✅
-            return jsonify({"error": "Service météo temporairement surchargé. Réessayez."}), 503
+            return _json_bytes(_ERR_RATE_LIMITED, 503)
 
         if 500 <= resp.status_code <= 599:
             brain.update(latency, success=True) # ✅
-            return jsonify({"error": "Service météo indisponible (erreur fournisseur)."}), 502
+            return _json_bytes(_ERR_PROVIDER, 502)
 
         resp.raise_for_status()
         
@@ -416,38 +544,38 @@ def _get_weather_impl():
                 '{"level":"WARN","request_id":"%s","msg":"Réponse OpenWeather inattendue","status":%s,"duration_ms":%s}',
                 getattr(g, "request_id", "unknown"), resp.status_code, dur_ms,
             )
-            return jsonify({"error": "Réponse inattendue du service météo."}), 502
+            return _json_bytes(_ERR_UNEXPECTED, 502)
 
         _cache_set(key, weather)
-        return jsonify(weather), 200
+        return _json(weather, 200)
 
     except requests.Timeout:
         # ✅ MODIF 3 : TIMEOUT -> On punit le cerveau (Backoff)
-        latency = time.time() - start
+        latency = time.monotonic() - start
         brain.update(latency, success=False)
-        return jsonify({"error": "Le service météo met trop de temps à répondre."}), 504
+        return _json_bytes(_ERR_TIMEOUT, 504)
 
     except requests.RequestException as e:
         # ✅ ERREUR RÉSEAU -> On punit aussi
-        latency = time.time() - start
+        latency = time.monotonic() - start
         brain.update(latency, success=False)
         
         logger.exception(
             '{"level":"ERROR","request_id":"%s","msg":"Erreur réseau OpenWeather","detail":"%s"}',
             getattr(g, "request_id", "unknown"), str(e).replace('"', "'"),
         )
-        return jsonify({"error": "Erreur de connexion au service météo."}), 502
+        return _json_bytes(_ERR_CONNECTION, 502)
 
     except (ValueError, TypeError) as e:
         # Erreur JSON = Le réseau a marché, mais le contenu est pourri. On considère ça comme un succès réseau.
-        latency = time.time() - start
+        latency = time.monotonic() - start
         brain.update(latency, success=True) 
         
         logger.exception(
             '{"level":"ERROR","request_id":"%s","msg":"Réponse OpenWeather invalide","detail":"%s"}',
             getattr(g, "request_id", "unknown"), str(e).replace('"', "'"),
         )
-        return jsonify({"error": "Réponse invalide du service météo."}), 502
+        return _json_bytes(_ERR_INVALID, 502)
 
 
 # -----------------------------------------------------------------------------
@@ -460,7 +588,7 @@ if limiter is not None:
 # -----------------------------------------------------------------------------
 # Route pour télécharger le README (AJOUTÉ)
 # -----------------------------------------------------------------------------
-@app.route("/download/readme")
+@app.route("/download/readme", methods=["GET"])
 def download_readme():
     """Permet au recruteur de télécharger le README directement."""
     try:
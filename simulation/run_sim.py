@@ -48,13 +48,13 @@ def run_simulation():
     print(f"Simulation de {len(scenario)} requêtes en cours...")
     
     # Initialisation du temps
-    brain.last_request_time = time.time()
+    brain.last_request_time = time.monotonic()
 
     for i, (latency, success, wait_time) in enumerate(scenario):
         # Simulation du temps qui passe (pour tester le TTL)
         if wait_time > 100:
             # On force l'horloge interne vers le passé pour simuler l'inactivité
-            brain.last_request_time = time.time() - wait_time - 1
+            brain.last_request_time = time.monotonic() - wait_time - 1
         
         # 1. L'algo décide du timeout AVANT la requête
         timeout_val = brain.get_timeout()
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Ajoute le dossier parent au path (une seule fois, à la collecte) pour importer app et algo
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
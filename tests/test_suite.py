@@ -1,20 +1,86 @@
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch
+from types import MappingProxyType, SimpleNamespace
+import dataclasses
+import datetime
+import itertools
+import json
 import time
-import sys
 import os
 import requests
 
-# Ajoute le dossier parent au path pour importer app et algo
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from flask.json.provider import DefaultJSONProvider
 
-from app import app, _cache
+from app import app, _cache, _autocomplete_cache, _parse_city, _parse_lat_lon
 from algo import PortfolioBrain
 
+
+# --- Réponses OpenWeather factices (construites une seule fois) ---
+# SimpleNamespace plutôt que MagicMock : accès attributs directs, pas d'historique d'appels.
+def _fake_resp(status, payload=None):
+    # Payload figé une fois pour toutes : json() renvoie toujours la même vue en lecture
+    # seule, et le corps brut (.content / .text) est pré-encodé.
+    content = json.dumps(payload).encode() if payload is not None else b""
+    if isinstance(payload, dict):
+        payload = MappingProxyType(payload)
+    elif isinstance(payload, list):
+        payload = tuple(payload)
+
+    def raise_for_status():
+        if status >= 400:
+            raise requests.HTTPError(f"{status} Error")
+
+    return SimpleNamespace(
+        status_code=status,
+        ok=status < 400,
+        headers={"Content-Type": "application/json"},
+        content=content,
+        text=content.decode(),
+        json=lambda: payload,
+        raise_for_status=raise_for_status,
+    )
+
+
+_GEO_PARIS = [{"name": "Paris", "country": "FR", "state": "Ile-de-France", "lat": 48.85, "lon": 2.35}]
+_GEO_LYON = [{"name": "Lyon", "country": "FR", "lat": 45.75, "lon": 4.85}]
+_OW_MARSEILLE = {
+    "weather": [{"description": "ciel clair", "icon": "01d"}],
+    "main": {"temp": 25.0, "humidity": 40, "pressure": 1013, "feels_like": 24.0},
+    "sys": {"country": "FR", "sunrise": 1600000000, "sunset": 1600050000},
+    "wind": {"speed": 5.0},
+    "coord": {"lat": 43.3, "lon": 5.4},
+    "name": "Marseille",
+    "visibility": 10000
+}
+_OW_LYON = {
+    "name": "Lyon",
+    "main": {"temp": 10},
+}
+
+_RESP_GEO_PARIS = _fake_resp(200, _GEO_PARIS)
+_RESP_GEO_LYON = _fake_resp(200, _GEO_LYON)
+_RESP_OW_MARSEILLE = _fake_resp(200, _OW_MARSEILLE)
+_RESP_OW_LYON = _fake_resp(200, _OW_LYON)
+_RESP_404 = _fake_resp(404)
+_RESP_429 = _fake_resp(429)
+
+
+@dataclasses.dataclass
+class _Point:
+    x: int
+    y: int
+
+
 class TestPortfolioBrain(unittest.TestCase):
     """Test de l'intelligence artificielle (Jacobson/Karn)"""
 
     def setUp(self):
+        # Horloge figée en compteur déterministe : pas d'appel système, et aucun
+        # réveil "Soft Decay" intempestif sur un runner CI lent. On remplace le module
+        # `time` vu par algo uniquement (time.monotonic reste intact pour le reste du process).
+        clock = patch("algo.time", SimpleNamespace(monotonic=itertools.count().__next__))
+        clock.start()
+        self.addCleanup(clock.stop)
         self.brain = PortfolioBrain()
 
     def test_initial_values(self):
@@ -23,8 +89,7 @@ class TestPortfolioBrain(unittest.TestCase):
         self.assertEqual(self.brain.get_timeout(), 5.0)
 
     def test_jacobson_update_success(self):
-        for _ in range(50):
-            self.brain.update(observed_latency=0.1, success=True)
+        self.brain.update_batch([0.1] * 50, success=True)
         self.assertLess(self.brain.get_timeout(), 5.0)
 
     def test_karn_penalty_failure(self):
@@ -34,18 +99,156 @@ class TestPortfolioBrain(unittest.TestCase):
         self.assertEqual(self.brain.get_timeout(), expected)
 
 
+    def test_attempt_counter_and_cap(self):
+        """Chaque échec incrémente attempt (borné), un succès le remet à 0"""
+        for n in range(1, PortfolioBrain.MAX_BACKOFF_ATTEMPTS + 3):
+            self.brain.update(observed_latency=10.0, success=False)
+            self.assertEqual(self.brain.attempt, min(n, PortfolioBrain.MAX_BACKOFF_ATTEMPTS))
+        self.brain.update(observed_latency=0.2, success=True)
+        self.assertEqual(self.brain.attempt, 0)
+
+    def test_rttvar_reset_after_failures(self):
+        """Premier succès après une panne : RTTVAR repart de INITIAL_RTTVAR, pas de l'ancienne valeur"""
+        rttvar = PortfolioBrain.INITIAL_RTTVAR
+        cases = [
+            ("yoyo", [0.2, 2.0] * 10, 2.0),   # RTTVAR au-dessus de 0.5 : le reset le réduit
+            ("stable", [0.05] * 200, 0.05),   # RTTVAR proche de 0 : le reset l'élargit (voulu)
+        ]
+        for label, warmup, latency in cases:
+            with self.subTest(label):
+                brain = PortfolioBrain()
+                brain.update_batch(warmup)
+                self.assertNotAlmostEqual(brain.rttvar, rttvar)
+                for _ in range(3):
+                    brain.update(observed_latency=10.0, success=False)
+                srtt = brain.srtt
+                brain.update(observed_latency=latency, success=True)  # dans la bande : Beta = 1/4
+                self.assertEqual(brain.attempt, 0)
+                self.assertAlmostEqual(brain.rttvar, rttvar + 0.25 * (abs(latency - srtt) - rttvar))
+
+    def test_rttvar_asymmetric_beta(self):
+        """Chute sous srtt - rttvar : Beta = 1/32 ; sinon Beta = 1/4"""
+        srtt, rttvar = PortfolioBrain.DEFAULT_TIMEOUT, PortfolioBrain.INITIAL_RTTVAR
+        cases = [
+            (0.1, 0.03125),  # 0.1 < 3.0 - 0.5 : amélioration, poids réduit
+            (4.0, 0.25),     # au-dessus de la bande : poids normal
+        ]
+        for latency, beta in cases:
+            with self.subTest(latency=latency):
+                brain = PortfolioBrain()
+                brain.update(observed_latency=latency, success=True)
+                self.assertAlmostEqual(brain.rttvar, rttvar + beta * (abs(latency - srtt) - rttvar))
+
+    def test_backoff_doubles_with_bounded_jitter(self):
+        """Backoff = RTO de base * 2^attempt + jitter dans [0, BACKOFF_JITTER]"""
+        self.brain.update_batch([0.1] * 50, success=True)
+        base = self.brain.get_timeout()
+        self.assertEqual(base, PortfolioBrain.TIMEOUT_MIN)
+        for n in range(1, 4):  # 2s, 4s, 8s : sous le plafond
+            with self.subTest(attempt=n):
+                self.brain.update(observed_latency=10.0, success=False)
+                jitter = self.brain.get_timeout() - base * 2 ** n
+                self.assertGreaterEqual(jitter, 0.0)
+                self.assertLessEqual(jitter, PortfolioBrain.BACKOFF_JITTER)
+        self.brain.update(observed_latency=10.0, success=False)
+        self.assertEqual(self.brain.get_timeout(), PortfolioBrain.TIMEOUT_MAX)
+
+    def test_backoff_curve(self):
+        """apply_backoff(n) = RTO de base * 2^n plafonné, sans jitter ni boucle d'update"""
+        self.brain.update_batch([0.1] * 50, success=True)
+        base = self.brain.get_timeout()
+        self.assertEqual(self.brain.apply_backoff(0), base)
+        for n in range(1, PortfolioBrain.MAX_BACKOFF_ATTEMPTS + 1):
+            with self.subTest(n_timeouts=n):
+                self.assertEqual(self.brain.apply_backoff(n), min(PortfolioBrain.TIMEOUT_MAX, base * 2 ** n))
+
+    def test_apply_backoff_is_read_only(self):
+        """Pas de Soft Decay ni d'exception sur n négatif : simple projection"""
+        self.brain.last_request_time = -PortfolioBrain.MEMORY_TTL * 2  # instance "endormie"
+        before = self.brain._state
+        self.assertEqual(self.brain.apply_backoff(-1), self.brain.apply_backoff(0))
+        self.assertIs(self.brain._state, before)
+
+    def test_no_p99_floor_below_min_samples(self):
+        """Moins de MIN_SAMPLES mesures : Jacobson seul, pas de plancher"""
+        self.brain.update_batch([2.5] * (PortfolioBrain.MIN_SAMPLES - 1))
+        self.assertEqual(self.brain.get_stats()["p99_floor"], 0.0)
+
+    def test_p99_floor_on_bimodal_latency(self):
+        """Régime chaud + Cold Starts : le plancher P99 tient le timeout au-dessus de Jacobson"""
+        warm, cold = 0.1, 2.5
+        self.brain.update_batch(([warm] * 9 + [cold]) * 9 + [warm] * 38)  # fenêtre pleine, 7% lents
+        jacobson = self.brain.srtt + 4 * self.brain.rttvar
+        floor = PortfolioBrain.P99_SAFETY_FACTOR * 4.096  # bucket [2048, 4096[ ms
+        self.assertLess(jacobson, PortfolioBrain.TIMEOUT_MIN)
+        self.assertAlmostEqual(self.brain.get_stats()["p99_floor"], floor)
+        self.assertAlmostEqual(self.brain.current_timeout, floor)
+
+    def test_p99_window_evicts_oldest_samples(self):
+        """Fenêtre pleine : les anciennes mesures sortent, le plancher redescend"""
+        size = PortfolioBrain.WINDOW_SIZE
+        self.brain.update_batch([2.5] * size)
+        self.brain.update_batch([0.1] * size)
+        self.assertEqual(sum(self.brain._counts), size)
+        self.assertAlmostEqual(self.brain.get_stats()["p99_floor"], PortfolioBrain.P99_SAFETY_FACTOR * 0.128)
+        self.assertEqual(self.brain.current_timeout, PortfolioBrain.TIMEOUT_MIN)
+
+
+class TestInputValidation(unittest.TestCase):
+    """Validation des paramètres testée directement (sans passer par Flask)"""
+
+    def test_parse_city(self):
+        cases = [
+            (None, None),
+            ("", None),
+            ("   ", None),
+            ("P", None),                      # trop court
+            ("x" * 65, None),                 # trop long
+            ("  Lyon  ", "Lyon"),             # espaces retirés
+            ("Saint-Étienne", "Saint-Étienne"),
+        ]
+        for raw, expected in cases:
+            with self.subTest(raw=raw):
+                self.assertEqual(_parse_city(raw), expected)
+
+    def test_parse_lat_lon(self):
+        cases = [
+            ((None, "2.35"), None),
+            (("48.85", None), None),
+            (("abc", "2.35"), None),
+            (("91", "2.35"), None),           # latitude hors bornes
+            (("48.85", "-181"), None),        # longitude hors bornes
+            (("48.85", "2.35"), (48.85, 2.35)),
+        ]
+        for (raw_lat, raw_lon), expected in cases:
+            with self.subTest(lat=raw_lat, lon=raw_lon):
+                self.assertEqual(_parse_lat_lon(raw_lat, raw_lon), expected)
+
+
 class TestGeoMeteoApp(unittest.TestCase):
     """Test des routes Flask (API) adaptées au vrai app.py"""
 
+    @classmethod
+    def setUpClass(cls):
+        # Un seul contexte applicatif et un seul client pour toute la classe
+        cls.ctx = app.app_context()
+        cls.ctx.push()
+        cls.client = app.test_client()
+        # index.html compilé une seule fois (cache Jinja) avant les tests, sans revérifier
+        # la date du fichier source à chaque rendu (valeur d'origine restaurée en fin de classe)
+        cls._jinja_auto_reload = app.jinja_env.auto_reload
+        app.jinja_env.auto_reload = False
+        cls.client.get("/")
+
+    @classmethod
+    def tearDownClass(cls):
+        app.jinja_env.auto_reload = cls._jinja_auto_reload
+        cls.ctx.pop()
+
     def setUp(self):
-        self.ctx = app.app_context()
-        self.ctx.push()
-        self.client = app.test_client()
         # On vide le cache avant chaque test pour éviter les interférences
         _cache.clear()
-
-    def tearDown(self):
-        self.ctx.pop()
+        _autocomplete_cache.clear()
 
     def test_health_check(self):
         """Vérifie la route de santé utilisée par Render"""
@@ -53,125 +256,125 @@ class TestGeoMeteoApp(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data, b"ok")
 
+    def test_health_check_bypasses_rate_limit(self):
+        """Les sondes passent avant Flask-Limiter : jamais de 429, même au-delà du quota par défaut"""
+        statuses = {self.client.get("/health").status_code for _ in range(150)}
+        self.assertEqual(statuses, {200})
+
+    def test_health_check_rejects_other_methods(self):
+        """Le court-circuit respecte le routage : POST /health reste un 405"""
+        self.assertEqual(self.client.head("/health").status_code, 200)
+        self.assertEqual(self.client.post("/health").status_code, 405)
+
+    @patch('requests.Session.get')
+    def test_head_get_weather_short_circuit(self, mock_session_get):
+        """Une sonde HEAD ne doit jamais déclencher d'appel OpenWeather"""
+        response = self.client.head("/get_weather?city=Paris")
+        self.assertEqual(response.status_code, 200)
+        mock_session_get.assert_not_called()
+
+    def test_head_get_weather_validates_like_get(self):
+        """HEAD renvoie le même statut que GET quand les paramètres sont invalides"""
+        for url in ("/get_weather", "/get_weather?city=", "/get_weather?lat=999&lon=0"):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.head(url).status_code, 400)
+                self.assertEqual(self.client.get(url).status_code, 400)
+
     def test_home_page(self):
         """Vérifie que la page principale charge le HTML"""
         response = self.client.get("/")
         self.assertEqual(response.status_code, 200)
         self.assertIn(b"<!DOCTYPE html>", response.data)
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_autocomplete_mock(self, mock_get):
-        """Test de l'autocomplétion (utilise requests.get dans app.py)"""
-        mock_resp = MagicMock()
-        mock_resp.status_code = 200
-        mock_resp.json.return_value = [
-            {"name": "Paris", "country": "FR", "state": "Ile-de-France", "lat": 48.85, "lon": 2.35}
-        ]
-        mock_get.return_value = mock_resp
+        """Test de l'autocomplétion (passe par la session partagée de app.py)"""
+        mock_get.return_value = _RESP_GEO_PARIS
 
         response = self.client.get("/autocomplete?q=Paris")
         self.assertEqual(response.status_code, 200)
-        data = response.json
+        data = response.get_json()
         self.assertEqual(len(data), 1)
         # Vérifie le formatage du label dicté par app.py
         self.assertEqual(data[0]['label'], "Paris, Ile-de-France, FR")
 
+    @patch('requests.Session.get')
+    def test_autocomplete_cache(self, mock_get):
+        """La même saisie (casse ignorée) ne doit interroger le géocodage qu'une fois"""
+        mock_get.return_value = _RESP_GEO_LYON
+
+        response1 = self.client.get("/autocomplete?q=Lyon")
+        response2 = self.client.get("/autocomplete?q=lyon")
+        self.assertEqual(response1.get_json(), response2.get_json())
+        self.assertEqual(mock_get.call_count, 1)
+
     def test_missing_city_parameter(self):
-        """Erreur 400 si aucun paramètre n'est fourni"""
+        """Erreur 400 si aucun paramètre n'est fourni (smoke test ; les cas limites sont
+        couverts au niveau des validateurs dans TestInputValidation)"""
         response = self.client.get("/get_weather") 
         self.assertEqual(response.status_code, 400)
-        self.assertIn("Veuillez fournir une ville valide", response.json["error"])
+        self.assertIn("Veuillez fournir une ville valide", response.get_json()["error"])
 
     # --- TESTS DES GESTIONS D'ERREURS (Unhappy Paths) ---
 
-    @patch('requests.Session.get')
-    def test_city_not_found_404(self, mock_session_get):
-        """L'API renvoie 404 (Ville introuvable)"""
-        mock_resp = MagicMock()
-        mock_resp.status_code = 404
-        mock_session_get.return_value = mock_resp
-
-        response = self.client.get("/get_weather?city=AtlantisLostCity")
-        self.assertEqual(response.status_code, 404)
-        self.assertEqual(response.json["error"], "Ville introuvable.")
-
-    @patch('requests.Session.get')
-    def test_openweather_rate_limit_429(self, mock_session_get):
-        """L'API renvoie 429 (Trop de requêtes) -> Transformé en 503"""
-        mock_resp = MagicMock()
-        mock_resp.status_code = 429
-        mock_session_get.return_value = mock_resp
-
-        response = self.client.get("/get_weather?city=Paris")
-        self.assertEqual(response.status_code, 503)
-        self.assertIn("temporairement surchargé", response.json["error"])
+    # (description, réponse OpenWeather ou exception, query, statut attendu, extrait du message)
+    _UPSTREAM_ERROR_CASES = [
+        ("L'API renvoie 404 (Ville introuvable)",
+         _RESP_404, "city=AtlantisLostCity", 404, "Ville introuvable."),
+        ("L'API renvoie 429 (Trop de requêtes) -> Transformé en 503",
+         _RESP_429, "city=Paris", 503, "temporairement surchargé"),
+        ("Crash réseau de type Timeout -> Transformé en 504",
+         requests.exceptions.Timeout("Trop long !"), "city=Paris", 504, "met trop de temps à répondre"),
+        ("Crash réseau de type ConnectionError -> Transformé en 502",
+         requests.exceptions.ConnectionError("Coupure internet"), "city=Paris", 502, "Erreur de connexion"),
+    ]
 
     @patch('requests.Session.get')
-    def test_api_timeout_error(self, mock_session_get):
-        """Crash réseau de type Timeout -> Transformé en 504"""
-        mock_session_get.side_effect = requests.exceptions.Timeout("Trop long !")
-
-        response = self.client.get("/get_weather?city=Paris")
-        self.assertEqual(response.status_code, 504)
-        self.assertIn("met trop de temps à répondre", response.json["error"])
-
-    @patch('requests.Session.get')
-    def test_api_connection_error(self, mock_session_get):
-        """Crash réseau de type ConnectionError -> Transformé en 502"""
-        mock_session_get.side_effect = requests.exceptions.ConnectionError("Coupure internet")
-
-        response = self.client.get("/get_weather?city=Paris")
-        self.assertEqual(response.status_code, 502)
-        self.assertIn("Erreur de connexion", response.json["error"])
+    def test_upstream_errors(self, mock_session_get):
+        """Chaque panne OpenWeather est traduite en statut + message cohérents"""
+        for desc, upstream, query, status, message in self._UPSTREAM_ERROR_CASES:
+            with self.subTest(desc):
+                if isinstance(upstream, Exception):
+                    mock_session_get.side_effect = upstream
+                else:
+                    mock_session_get.side_effect = None
+                    mock_session_get.return_value = upstream
+
+                response = self.client.get(f"/get_weather?{query}")
+                self.assertEqual(response.status_code, status)
+                self.assertIn(message, response.get_json()["error"])
 
     # --- TESTS DU CAS NOMINAL ET DU CACHE ---
 
     @patch('requests.Session.get')
     def test_full_weather_api_logic(self, mock_session_get):
         """Test API standard : On vérifie le mapping des données de retour"""
-        mock_resp = MagicMock()
-        mock_resp.status_code = 200
-        mock_resp.json.return_value = {
-            "weather": [{"description": "ciel clair", "icon": "01d"}],
-            "main": {"temp": 25.0, "humidity": 40, "pressure": 1013, "feels_like": 24.0},
-            "sys": {"country": "FR", "sunrise": 1600000000, "sunset": 1600050000},
-            "wind": {"speed": 5.0},
-            "coord": {"lat": 43.3, "lon": 5.4},
-            "name": "Marseille",
-            "visibility": 10000
-        }
-        mock_session_get.return_value = mock_resp
+        mock_session_get.return_value = _RESP_OW_MARSEILLE
 
         response = self.client.get("/get_weather?city=Marseille")
         self.assertEqual(response.status_code, 200)
         
-        data = response.json
-        self.assertEqual(data['city'], "Marseille")
+        data = response.get_json()
+        self.assertEqual(data['city'], "Marseille, FR")
         self.assertEqual(data['temperature'], 25.0)
         self.assertEqual(data['description'], "ciel clair")
 
     @patch('requests.Session.get')
     def test_caching_mechanism(self, mock_session_get):
         """Test du cache LRU mémoire : la 2ème requête ne doit pas appeler l'API"""
-        mock_resp = MagicMock()
-        mock_resp.status_code = 200
-        mock_resp.json.return_value = {
-            "name": "Lyon",
-            "main": {"temp": 10},
-        }
-        mock_session_get.return_value = mock_resp
+        mock_session_get.return_value = _RESP_OW_LYON
 
         # Appel 1 : L'API est appelée, le cache est vide
         response1 = self.client.get("/get_weather?city=Lyon")
         self.assertEqual(response1.status_code, 200)
-        self.assertNotIn("_cached", response1.json)
+        self.assertNotIn("_cached", response1.get_json())
         
         # Appel 2 : Les données viennent du cache
         response2 = self.client.get("/get_weather?city=Lyon")
         self.assertEqual(response2.status_code, 200)
         
         # Le code app.py injecte "_cached": True quand ça vient du cache !
-        self.assertTrue(response2.json.get("_cached"))
+        self.assertTrue(response2.get_json().get("_cached"))
         
         # requests.Session.get ne doit avoir été appelé qu'UNE SEULE FOIS
         self.assertEqual(mock_session_get.call_count, 1)
@@ -194,5 +397,14 @@ class TestGeoMeteoApp(unittest.TestCase):
         self.assertIn('X-Content-Type-Options', response.headers)
         self.assertEqual(response.headers['X-Frame-Options'], 'DENY')
 
-if __name__ == "__main__":
-    unittest.main()
\ No newline at end of file
+    def test_json_provider_honors_dump_options(self):
+        """Le provider orjson accepte les clés non-str, respecte sort_keys / indent et sérialise les dates comme Flask"""
+        self.assertEqual(app.json.dumps({"b": 1, 2: "x"}), '{"b":1,"2":"x"}')
+        self.assertEqual(app.json.dumps({"b": 1, "a": 2}, sort_keys=True), '{"a":2,"b":1}')
+        self.assertEqual(app.json.dumps({"a": 1}, indent=2), '{\n  "a": 1\n}')
+        # Dates et dataclasses passent par default() : même sortie que le provider Flask
+        flask_json = DefaultJSONProvider(app)
+        for value in (datetime.date(2024, 1, 2), datetime.datetime(2024, 1, 2, 3, 4, 5)):
+            with self.subTest(value=value):
+                self.assertEqual(app.json.dumps(value), flask_json.dumps(value))
+        self.assertEqual(app.json.dumps(_Point(1, 2)), '{"x":1,"y":2}')